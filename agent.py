@@ -1,6 +1,7 @@
 import asyncio
 import os
 import re
+import signal
 import sys
 import threading
 from datetime import datetime
@@ -105,8 +106,8 @@ except ImportError as e:
 
 # Import full-featured behavior tracker
 try:
-    from user_behavior_tracker import UserBehaviorTracker
-    behavior_tracker = UserBehaviorTracker()
+    # Reuse the module-level tracker (one flusher thread) and its Supabase client for the monitor
+    from user_behavior_tracker import behavior_tracker, supabase as tracker_supabase
     print("[BEHAVIOR] ✅ Using full UserBehaviorTracker with personalization and learning")
 except ImportError as e:
     print(f"[BEHAVIOR] ⚠️ Failed to import UserBehaviorTracker: {e}")
@@ -140,6 +141,7 @@ except ImportError as e:
             pass  # No-op for simple tracker
     
     behavior_tracker = SimpleBehaviorTracker()
+    tracker_supabase = None
 
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
@@ -1008,10 +1010,10 @@ async def monitor_disasters():
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
     
-    # Create Supabase client
+    # Create Supabase client, sharing the behavior tracker's client when it has one
     # Handle version incompatibility issues
     try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase: Client = tracker_supabase or create_client(SUPABASE_URL, SUPABASE_KEY)
     except (TypeError, AttributeError) as e:
         error_msg = str(e).lower()
         if "proxy" in error_msg or "unexpected keyword argument" in error_msg:
@@ -1044,32 +1046,46 @@ async def monitor_disasters():
     await application.start()
     await application.updater.start_polling()
     
-    print("🤖 Disaster monitor started. Listening for new disasters...")
-    print(f"📊 Checking every {POLL_INTERVAL} seconds")
-    
-    # Initialize: Mark all existing disasters as processed (don't create topics for them)
-    await initialize_existing_disasters(supabase)
-    
-    # Initial check for any disasters added between initialization and now
-    await check_new_disasters(bot, supabase)
+    # Cloud Run stops containers with SIGTERM, which skips atexit handlers; cancel the
+    # main task instead so the finally below flushes buffered behavior rows. Installed as
+    # soon as polling starts, since messages (and behavior rows) can arrive from then on.
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Signal handlers are unavailable on Windows event loops
     
-    # Periodic monitoring loop
-    while True:
-        try:
-            await asyncio.sleep(POLL_INTERVAL)
-            await check_new_disasters(bot, supabase)
-            # Update existing disaster info periodically (every 5 checks)
-            if len(processed_disasters) % 5 == 0:
-                await update_disaster_info(bot, supabase)
-        except KeyboardInterrupt:
-            print("\n🛑 Stopping monitor...")
-            await application.updater.stop()
-            await application.stop()
-            await application.shutdown()
-            break
-        except Exception as e:
-            print(f"❌ Error in monitoring loop: {e}")
-            await asyncio.sleep(POLL_INTERVAL)
+    try:
+        print("🤖 Disaster monitor started. Listening for new disasters...")
+        print(f"📊 Checking every {POLL_INTERVAL} seconds")
+        
+        # Initialize: Mark all existing disasters as processed (don't create topics for them)
+        await initialize_existing_disasters(supabase)
+        
+        # Initial check for any disasters added between initialization and now
+        await check_new_disasters(bot, supabase)
+        
+        # Periodic monitoring loop
+        while True:
+            try:
+                await asyncio.sleep(POLL_INTERVAL)
+                await check_new_disasters(bot, supabase)
+                # Update existing disaster info periodically (every 5 checks)
+                if len(processed_disasters) % 5 == 0:
+                    await update_disaster_info(bot, supabase)
+            except KeyboardInterrupt:
+                print("\n🛑 Stopping monitor...")
+                await application.updater.stop()
+                await application.stop()
+                await application.shutdown()
+                break
+            except Exception as e:
+                print(f"❌ Error in monitoring loop: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        # Push any buffered behavior rows to Supabase off the event loop.
+        # Runs on cancellation too: under asyncio.run, Ctrl+C arrives here as CancelledError.
+        if behavior_tracker and hasattr(behavior_tracker, 'flush_async'):
+            await behavior_tracker.flush_async()
 
 
 if __name__ == "__main__":
@@ -1106,6 +1122,8 @@ if __name__ == "__main__":
         asyncio.run(monitor_disasters())
     except KeyboardInterrupt:
         print("\n👋 Monitor stopped by user")
+    except asyncio.CancelledError:
+        print("\n👋 Monitor stopped (SIGTERM)")
     except Exception as e:
         print(f"\n❌ Fatal error: {e}")
         import traceback
@@ -3,11 +3,20 @@ User Behavior Tracking and Personalization System
 Tracks user interactions and learns from behavior to improve agent responses
 """
 
+import asyncio
 import json
+import os
+import random
+import re
+import time
+import atexit
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
-from collections import defaultdict
-from dataclasses import dataclass, asdict
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from contextlib import nullcontext
 
 # Opik integration - use native Opik
@@ -22,9 +31,14 @@ except ImportError:
     def start_as_current_span(*args, **kwargs):
         return nullcontext()
 
+# Tracing sites use a shared no-op context (and skip building trace inputs) when Opik is missing
+_TRACE_ENABLED = OPIK_AVAILABLE
+_NULL_CTX = nullcontext()
+
 try:
     from supabase import create_client, Client
-    import os
+    from postgrest.types import ReturnMethod
+    import httpx
     from dotenv import load_dotenv
     load_dotenv()
     SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -36,8 +50,105 @@ try:
 except:
     supabase = None
 
+# Background flush settings for batched Supabase inserts
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0  # seconds
+MAX_PENDING_ROWS = 10_000  # per table, bounds the buffer while Supabase is unreachable
+
+# Retry and circuit breaker settings for Supabase writes
+CIRCUIT_BREAKER_THRESHOLD = 5  # consecutive failed flushes before opening the circuit
+CIRCUIT_RESET_AFTER = 30.0  # seconds
+# PostgREST connection/timeout codes and Postgres connection, timeout and contention SQLSTATEs
+TRANSIENT_ERROR_CODES = {
+    "PGRST000", "PGRST001", "PGRST002", "PGRST003",
+    "57014", "57P01", "53300", "40001", "40P01"
+}
+# Gateway/server HTTP statuses (postgrest-py reports these as the APIError code for non-JSON bodies)
+TRANSIENT_HTTP_STATUSES = {500, 502, 503, 504}
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a Supabase error is worth retrying (network failures, timeouts, overload)"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if supabase and isinstance(error, httpx.TransportError):
+        return True
+    if supabase and isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in TRANSIENT_HTTP_STATUSES
+    code = str(getattr(error, "code", "") or "")
+    if code.isdigit() and int(code) in TRANSIENT_HTTP_STATUSES:
+        return True
+    return code in TRANSIENT_ERROR_CODES or code.startswith("08")
+
+
+def is_row_error(error: Exception) -> bool:
+    """Whether a Supabase error is caused by the data of individual rows (bad values, constraints, serialization)"""
+    if isinstance(error, (TypeError, ValueError)):
+        return True
+    code = str(getattr(error, "code", "") or "")
+    # SQLSTATE class 22 (data exception) and 23 (integrity constraint violation)
+    return len(code) == 5 and code[:2] in ("22", "23")
+
+
+def is_missing_table_error(error: Exception) -> bool:
+    """Whether a Supabase error means the target table does not exist"""
+    error_msg = str(error)
+    return getattr(error, "code", None) == "PGRST205" or "Could not find the table" in error_msg or "PGRST205" in error_msg
+
+
+def retry_db_operation(operation, max_retries: int = 6, base_delay: float = 0.1, max_delay: float = 10.0):
+    """Run a Supabase operation, retrying transient failures with exponential backoff and jitter"""
+    for attempt in range(max_retries):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt == max_retries - 1 or not is_transient_error(e):
+                raise
+            time.sleep(min(max_delay, base_delay * 2 ** attempt) + random.random() * 0.05)
 
-@dataclass
+
+# Cached result of the Supabase table probes, shared across process restarts
+SUPABASE_TABLES_CACHE_PATH = os.getenv(
+    "SUPABASE_TABLES_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "tgbot_supabase_tables.json")
+)
+SUPABASE_TABLES_CACHE_TTL = 86400  # seconds
+
+# In-memory retention limits (older data lives in Supabase)
+MAX_INTERACTIONS = 50_000
+MAX_OFF_TRACK_USERS = 10_000
+PROFILE_TTL = timedelta(days=30)
+PROFILE_SWEEP_INTERVAL = timedelta(hours=1)
+
+# Window used for response style analysis
+STYLE_WINDOW = timedelta(days=7)
+
+# Number of recent satisfaction scores averaged for personalization
+SATISFACTION_WINDOW = 5
+
+# Precompiled indicator patterns (single C-level scan instead of a substring loop).
+# Patterns are lowercase and matched against text lowercased once at ingest.
+OFF_TRACK_RE = re.compile(
+    "|".join(re.escape(indicator.lower()) for indicator in [
+        "I don't understand",
+        "That's not what I asked",
+        "Wrong",
+        "No, that's not right",
+        "You're not helping",
+        "This is useless"
+    ])
+)
+CONCISE_RE = re.compile(r"short|brief|quick|summary")
+DETAILED_RE = re.compile(r"more|details|explain|elaborate")
+FEEDBACK_SIGNAL_RE = re.compile(
+    r"(?P<too_long>too long|verbose)"
+    r"|(?P<too_short>too short|brief)"
+    r"|(?P<not_helpful>not helpful|useless)"
+    r"|(?P<inaccurate>wrong|incorrect)"
+    r"|(?P<tone_issue>rude|inappropriate)"
+)
+
+
+@dataclass(slots=True)
 class UserInteraction:
     """Record of a user interaction"""
     user_id: str
@@ -45,45 +156,102 @@ class UserInteraction:
     agent_name: str
     input_text: str
     output_text: str
-    timestamp: str
+    timestamp: datetime
     satisfaction_score: Optional[float] = None
     feedback: Optional[str] = None
     metadata: Dict[str, Any] = None
+    input_text_lc: str = field(init=False, repr=False)  # lowercased once for indicator matching
+    
+    def __post_init__(self):
+        self.input_text_lc = self.input_text.lower()
     
     def to_dict(self):
-        return asdict(self)
+        return {
+            "user_id": self.user_id,
+            "interaction_type": self.interaction_type,
+            "agent_name": self.agent_name,
+            "input_text": self.input_text,
+            "output_text": self.output_text,
+            "timestamp": self.timestamp.isoformat(),
+            "satisfaction_score": self.satisfaction_score,
+            "feedback": self.feedback,
+            "metadata": self.metadata
+        }
 
 
-@dataclass
+@dataclass(slots=True)
 class UserProfile:
     """User behavior profile"""
     user_id: str
     interaction_count: int = 0
     preferred_response_style: str = "balanced"  # "concise", "detailed", "balanced"
     common_questions: List[str] = None
-    satisfaction_history: List[float] = None
-    last_interaction: Optional[str] = None
+    satisfaction_history: deque = None  # last SATISFACTION_WINDOW scores
+    last_interaction: Optional[datetime] = None
     preferences: Dict[str, Any] = None
+    _sat_sum_recent: float = field(init=False, default=0.0, repr=False)
     
     def __post_init__(self):
         if self.common_questions is None:
             self.common_questions = []
         if self.satisfaction_history is None:
-            self.satisfaction_history = []
+            self.satisfaction_history = deque(maxlen=SATISFACTION_WINDOW)
+        else:
+            self.satisfaction_history = deque(self.satisfaction_history, maxlen=SATISFACTION_WINDOW)
+        self._sat_sum_recent = sum(self.satisfaction_history)
         if self.preferences is None:
             self.preferences = {}
+    
+    def add_satisfaction(self, score: float):
+        """Append a score to the recent window, keeping the running sum in step"""
+        history = self.satisfaction_history
+        if len(history) == history.maxlen:
+            self._sat_sum_recent -= history[0]
+        history.append(score)
+        self._sat_sum_recent += score
+    
+    def recent_satisfaction_avg(self) -> Optional[float]:
+        """Average of the recent satisfaction window, or None if empty"""
+        if not self.satisfaction_history:
+            return None
+        return self._sat_sum_recent / len(self.satisfaction_history)
 
 
 class UserBehaviorTracker:
     """Track and learn from user behavior"""
     
     def __init__(self):
-        self.interactions: List[UserInteraction] = []
+        self.interactions: deque = deque(maxlen=MAX_INTERACTIONS)
         self.user_profiles: Dict[str, UserProfile] = {}
-        self.off_track_patterns: Dict[str, int] = defaultdict(int)
+        # LRU-ordered off-track counters, capped at MAX_OFF_TRACK_USERS
+        self.off_track_patterns: "OrderedDict[str, int]" = OrderedDict()
+        self._last_profile_sweep = datetime.now()
+        # Running aggregates for reliability metrics
+        self._total_interactions = 0
+        self._sat_sum = 0.0
+        self._sat_count = 0
+        self._agent_stats: Dict[str, List[float]] = {}  # agent -> [count, sat_sum, sat_count]
+        # Per-user recent (timestamp, lowercased input) pairs for style analysis
+        self._by_user: Dict[str, deque] = {}
         self._supabase_tables_checked = False
         self._has_user_interactions_table = False
         self._has_user_learning_table = False
+        self._load_supabase_tables_cache()
+        
+        # Rows waiting to be bulk-inserted into Supabase by the flusher thread
+        self._pending_interactions: deque = deque()
+        self._pending_learning: deque = deque()
+        self._dropped_pending = 0  # rows evicted because a queue hit MAX_PENDING_ROWS, logged by the flusher
+        self._consecutive_failures = 0
+        self._circuit_open_until = 0.0
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        if supabase:
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, name="behavior-flusher", daemon=True
+            )
+            self._flush_thread.start()
+            atexit.register(self._flush_all)
     
     def record_interaction(
         self,
@@ -104,16 +272,17 @@ class UserBehaviorTracker:
                 "agent": agent_name,
                 "interaction_type": interaction_type
             }
-        )
+        ) if _TRACE_ENABLED else _NULL_CTX
         
         with trace_context:
+            now = datetime.now()
             interaction = UserInteraction(
                 user_id=user_id,
                 interaction_type=interaction_type,
                 agent_name=agent_name,
                 input_text=input_text,
                 output_text=output_text,
-                timestamp=datetime.now().isoformat(),
+                timestamp=now,
                 satisfaction_score=satisfaction_score,
                 feedback=feedback,
                 metadata=metadata or {}
@@ -121,6 +290,26 @@ class UserBehaviorTracker:
             
             self.interactions.append(interaction)
             
+            # Update running aggregates
+            self._total_interactions += 1
+            agent_stats = self._agent_stats.setdefault(agent_name, [0, 0.0, 0])
+            agent_stats[0] += 1
+            if satisfaction_score is not None:
+                self._sat_sum += satisfaction_score
+                self._sat_count += 1
+                agent_stats[1] += satisfaction_score
+                agent_stats[2] += 1
+            
+            # Index recent input per user, dropping entries outside the style window
+            recent = self._by_user.setdefault(user_id, deque())
+            recent.append((now, interaction.input_text_lc))
+            while now - recent[0][0] > STYLE_WINDOW:
+                recent.popleft()
+            
+            # Periodically drop profiles of users inactive for longer than PROFILE_TTL
+            if now - self._last_profile_sweep > PROFILE_SWEEP_INTERVAL:
+                self._evict_inactive_profiles(now)
+            
             # Update user profile
             if user_id not in self.user_profiles:
                 self.user_profiles[user_id] = UserProfile(user_id=user_id)
@@ -130,85 +319,263 @@ class UserBehaviorTracker:
             profile.last_interaction = interaction.timestamp
             
             if satisfaction_score is not None:
-                profile.satisfaction_history.append(satisfaction_score)
+                profile.add_satisfaction(satisfaction_score)
             
             # Detect off-track behavior
             self._detect_off_track(user_id, interaction)
             
-            # Save to Supabase if available (gracefully handle missing tables)
+            # Queue for batched save to Supabase (serialized by background thread)
             if supabase:
-                # Check table existence on first use
-                if not self._supabase_tables_checked:
-                    self._check_supabase_tables()
+                self._enqueue(self._pending_interactions, interaction)
+    
+    def _enqueue(self, queue: deque, item: Any):
+        """Queue a row for the flusher, evicting the oldest row once MAX_PENDING_ROWS is reached"""
+        if len(queue) >= MAX_PENDING_ROWS:
+            queue.popleft()
+            self._dropped_pending += 1
+        queue.append(item)
+        if len(queue) >= BATCH_SIZE:
+            self._flush_event.set()
+    
+    def _requeue(self, table_name: str, queue: deque, items: List[Any]):
+        """Put unsent rows back at the front of the queue, dropping the oldest if they no longer fit"""
+        overflow = len(queue) + len(items) - MAX_PENDING_ROWS
+        if overflow > 0:
+            print(f"⚠️ Pending queue for {table_name} is full, dropped {min(overflow, len(items))} oldest rows")
+            items = items[overflow:]
+        queue.extendleft(reversed(items))
+    
+    def _flush_loop(self):
+        """Background loop that flushes pending rows every FLUSH_INTERVAL or when a batch fills up"""
+        while True:
+            self._flush_event.wait(FLUSH_INTERVAL)
+            self._flush_event.clear()
+            try:
+                self._flush_all()
+            except Exception as e:
+                print(f"[BEHAVIOR] ⚠️ Background flush failed: {e}")
+    
+    def _flush_all(self):
+        """Bulk-insert all pending rows into Supabase (gracefully handle missing tables)"""
+        if not supabase:
+            return
+        
+        with self._flush_lock:
+            if self._dropped_pending:
+                dropped, self._dropped_pending = self._dropped_pending, 0
+                print(f"⚠️ Pending Supabase queue full, dropped {dropped} oldest rows")
+            
+            # Check table existence on first use
+            if not self._supabase_tables_checked:
+                self._check_supabase_tables()
+            
+            # Circuit open: keep rows buffered until the database has had time to recover
+            if time.monotonic() < self._circuit_open_until:
+                return
+            
+            if self._has_user_interactions_table:
+                self._flush_queue('user_interactions', self._pending_interactions, UserInteraction.to_dict)
+            else:
+                # Table doesn't exist, data is still stored in memory (self.interactions)
+                self._pending_interactions.clear()
+            
+            if self._has_user_learning_table:
+                self._flush_queue('user_learning', self._pending_learning, self._learning_row)
+            else:
+                # Table doesn't exist, learning is still stored in user profile preferences
+                self._pending_learning.clear()
+    
+    def _flush_queue(self, table_name: str, queue: deque, serialize):
+        """Insert one table's pending rows in BATCH_SIZE slices, requeueing a slice on transient failure"""
+        while queue and time.monotonic() >= self._circuit_open_until:
+            pending = self._drain(queue, BATCH_SIZE)
+            rows = [serialize(item) for item in pending]
+            try:
+                retry_db_operation(
+                    lambda: supabase.table(table_name).insert(rows, returning=ReturnMethod.minimal).execute()
+                )
+                self._consecutive_failures = 0
+            except Exception as e:
+                if is_row_error(e):
+                    # One bad row rejects the whole insert; retry row by row so only bad rows are lost
+                    if not self._insert_rows_individually(table_name, queue, pending, rows):
+                        return
+                    continue
+                
+                # Put the slice back in its original order and leave the rest queued for the next flush
+                self._requeue(table_name, queue, pending)
+                if is_missing_table_error(e):
+                    self._mark_table_missing(table_name)
+                    print(f"[BEHAVIOR] ℹ️ Supabase table {table_name} not found: {e}")
+                    return
                 
-                if self._has_user_interactions_table:
-                    try:
-                        supabase.table('user_interactions').insert(interaction.to_dict()).execute()
-                    except Exception as e:
-                        print(f"⚠️ Failed to save interaction to Supabase: {e}")
-                # If table doesn't exist, data is still stored in memory (self.interactions)
+                # Transient outage, or an error that rejects every row alike (permissions, auth)
+                self._consecutive_failures += 1
+                reason = "unavailable" if is_transient_error(e) else "rejected insert"
+                print(f"⚠️ Supabase {reason}, {len(queue)} rows for {table_name} kept for retry: {e}")
+                if self._consecutive_failures >= CIRCUIT_BREAKER_THRESHOLD:
+                    self._circuit_open_until = time.monotonic() + CIRCUIT_RESET_AFTER
+                    print(f"[BEHAVIOR] ⚠️ Supabase circuit open for {CIRCUIT_RESET_AFTER:.0f}s after {self._consecutive_failures} failed flushes")
+                return
+    
+    def _mark_table_missing(self, table_name: str):
+        """Stop writing to a table that Supabase reports as missing and re-probe on the next flush"""
+        if table_name == 'user_interactions':
+            self._has_user_interactions_table = False
+        elif table_name == 'user_learning':
+            self._has_user_learning_table = False
+        
+        # The cached positive probe is stale; drop it so this and restarted workers probe again
+        self._supabase_tables_checked = False
+        try:
+            os.remove(SUPABASE_TABLES_CACHE_PATH)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[BEHAVIOR] ⚠️ Failed to clear Supabase table cache: {e}")
+    
+    def _insert_rows_individually(self, table_name: str, queue: deque, pending: List[Any], rows: List[Dict[str, Any]]) -> bool:
+        """Insert rows one at a time after a rejected batch; returns False if Supabase became unavailable"""
+        lost = 0
+        last_error = None
+        for index, row in enumerate(rows):
+            try:
+                supabase.table(table_name).insert(row, returning=ReturnMethod.minimal).execute()
+            except Exception as e:
+                if is_transient_error(e):
+                    # Keep the rows not yet attempted for the next flush
+                    self._requeue(table_name, queue, pending[index:])
+                    if lost:
+                        print(f"⚠️ Dropped {lost} rejected rows for Supabase table {table_name}: {last_error}")
+                    return False
+                lost += 1
+                last_error = e
+        if lost:
+            print(f"⚠️ Dropped {lost} of {len(rows)} rows rejected by Supabase table {table_name}: {last_error}")
+        return True
+    
+    async def flush_async(self):
+        """Flush pending rows from async code without blocking the event loop"""
+        await asyncio.to_thread(self._flush_all)
+    
+    @staticmethod
+    def _learning_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Serialize a pending learning row for Supabase"""
+        return {**row, "timestamp": row["timestamp"].isoformat()}
+    
+    @staticmethod
+    def _drain(queue: deque, limit: int) -> List[Any]:
+        """Pop up to limit items from the front of the queue"""
+        rows = []
+        while queue and len(rows) < limit:
+            rows.append(queue.popleft())
+        return rows
+    
+    def _evict_inactive_profiles(self, now: datetime):
+        """Remove profiles (and their per-user state) whose last interaction is older than PROFILE_TTL"""
+        self._last_profile_sweep = now
+        stale = [
+            user_id for user_id, profile in self.user_profiles.items()
+            if profile.last_interaction is not None and now - profile.last_interaction > PROFILE_TTL
+        ]
+        for user_id in stale:
+            del self.user_profiles[user_id]
+            self._by_user.pop(user_id, None)
+            self.off_track_patterns.pop(user_id, None)
+        if stale:
+            print(f"[BEHAVIOR] ℹ️ Evicted {len(stale)} inactive user profiles")
+    
+    def _mark_off_track(self, user_id: str):
+        """Increment the user's off-track counter, evicting the least recently flagged user when full"""
+        self.off_track_patterns[user_id] = self.off_track_patterns.get(user_id, 0) + 1
+        self.off_track_patterns.move_to_end(user_id)
+        if len(self.off_track_patterns) > MAX_OFF_TRACK_USERS:
+            self.off_track_patterns.popitem(last=False)
     
     def _detect_off_track(self, user_id: str, interaction: UserInteraction):
         """Detect if user is going off-track"""
-        span_context = start_as_current_span(name="detect_off_track")
+        span_context = start_as_current_span(name="detect_off_track") if _TRACE_ENABLED else _NULL_CTX
         with span_context:
-            # Patterns that indicate user is off-track
-            off_track_indicators = [
-                "I don't understand",
-                "That's not what I asked",
-                "Wrong",
-                "No, that's not right",
-                "You're not helping",
-                "This is useless"
-            ]
-            
-            input_lower = interaction.input_text.lower()
-            feedback_lower = (interaction.feedback or "").lower()
-            
             # Check for off-track indicators
-            for indicator in off_track_indicators:
-                if indicator.lower() in input_lower or indicator.lower() in feedback_lower:
-                    self.off_track_patterns[user_id] += 1
-                    print(f"[BEHAVIOR] ⚠️ User {user_id} appears off-track (pattern: {indicator})")
-                    return True
+            match = OFF_TRACK_RE.search(interaction.input_text_lc) or OFF_TRACK_RE.search((interaction.feedback or "").lower())
+            if match:
+                self._mark_off_track(user_id)
+                print(f"[BEHAVIOR] ⚠️ User {user_id} appears off-track (pattern: {match.group(0)})")
+                return True
             
             # Low satisfaction score
             if interaction.satisfaction_score is not None and interaction.satisfaction_score < 3:
-                self.off_track_patterns[user_id] += 1
+                self._mark_off_track(user_id)
                 print(f"[BEHAVIOR] ⚠️ User {user_id} low satisfaction: {interaction.satisfaction_score}")
                 return True
             
             return False
     
+    def _load_supabase_tables_cache(self):
+        """Restore table availability from a recent on-disk probe result, skipping the live probes"""
+        if not supabase:
+            return
+        try:
+            with open(SUPABASE_TABLES_CACHE_PATH) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        if not isinstance(cached, dict):
+            return
+        if cached.get("url") != SUPABASE_URL or time.time() - cached.get("ts", 0) >= SUPABASE_TABLES_CACHE_TTL:
+            return
+        
+        # Only positive results are cached; a missing table is re-probed so creating it takes effect
+        if not (cached.get("interactions") and cached.get("learning")):
+            return
+        
+        self._has_user_interactions_table = True
+        self._has_user_learning_table = True
+        self._supabase_tables_checked = True
+    
+    @staticmethod
+    def _probe_table(table_name: str) -> bool:
+        """Return whether a Supabase table exists"""
+        try:
+            supabase.table(table_name).select('id').limit(1).execute()
+            return True
+        except Exception as e:
+            if is_missing_table_error(e):
+                return False
+            # Other error, assume table exists
+            return True
+    
     def _check_supabase_tables(self):
         """Check which Supabase tables are available"""
         if not supabase:
             self._supabase_tables_checked = True
             return
         
+        # Probe both tables concurrently
         try:
-            # Try to query user_interactions table
-            supabase.table('user_interactions').select('id').limit(1).execute()
-            self._has_user_interactions_table = True
-        except Exception as e:
-            error_msg = str(e)
-            if "Could not find the table" in error_msg or "PGRST205" in error_msg:
-                self._has_user_interactions_table = False
-            else:
-                # Other error, assume table exists
-                self._has_user_interactions_table = True
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                interactions_probe = pool.submit(self._probe_table, 'user_interactions')
+                learning_probe = pool.submit(self._probe_table, 'user_learning')
+                self._has_user_interactions_table = interactions_probe.result()
+                self._has_user_learning_table = learning_probe.result()
+        except RuntimeError:
+            # Executors refuse new work during interpreter shutdown (atexit flush)
+            self._has_user_interactions_table = self._probe_table('user_interactions')
+            self._has_user_learning_table = self._probe_table('user_learning')
         
-        try:
-            # Try to query user_learning table
-            supabase.table('user_learning').select('id').limit(1).execute()
-            self._has_user_learning_table = True
-        except Exception as e:
-            error_msg = str(e)
-            if "Could not find the table" in error_msg or "PGRST205" in error_msg:
-                self._has_user_learning_table = False
-            else:
-                # Other error, assume table exists
-                self._has_user_learning_table = True
+        # Persist a positive result so restarted workers can skip the probes
+        if self._has_user_interactions_table and self._has_user_learning_table:
+            try:
+                with open(SUPABASE_TABLES_CACHE_PATH, 'w') as f:
+                    json.dump({
+                        "ts": time.time(),
+                        "url": SUPABASE_URL,
+                        "interactions": True,
+                        "learning": True
+                    }, f)
+            except OSError as e:
+                print(f"[BEHAVIOR] ⚠️ Failed to cache Supabase table check: {e}")
         
         self._supabase_tables_checked = True
         
@@ -235,19 +602,16 @@ class UserBehaviorTracker:
         if profile.interaction_count < 3:
             return "balanced"  # Default
         
-        # Analyze interaction patterns
-        recent_interactions = [
-            i for i in self.interactions 
-            if i.user_id == user_id 
-            and (datetime.now() - datetime.fromisoformat(i.timestamp)) < timedelta(days=7)
+        # Analyze recent interaction patterns from the per-user index
+        now = datetime.now()
+        recent_inputs = [
+            text for ts, text in self._by_user.get(user_id, ())
+            if now - ts < STYLE_WINDOW
         ]
         
         # Check for patterns indicating preference
-        concise_indicators = ["short", "brief", "quick", "summary"]
-        detailed_indicators = ["more", "details", "explain", "elaborate"]
-        
-        concise_count = sum(1 for i in recent_interactions if any(ind in i.input_text.lower() for ind in concise_indicators))
-        detailed_count = sum(1 for i in recent_interactions if any(ind in i.input_text.lower() for ind in detailed_indicators))
+        concise_count = sum(1 for text in recent_inputs if CONCISE_RE.search(text))
+        detailed_count = sum(1 for text in recent_inputs if DETAILED_RE.search(text))
         
         if concise_count > detailed_count:
             return "concise"
@@ -258,7 +622,7 @@ class UserBehaviorTracker:
     
     def get_personalized_prompt_adjustments(self, user_id: str, base_prompt: str) -> str:
         """Get personalized prompt adjustments based on user behavior"""
-        span_context = start_as_current_span(name="personalize_prompt")
+        span_context = start_as_current_span(name="personalize_prompt") if _TRACE_ENABLED else _NULL_CTX
         with span_context:
             profile = self.get_user_profile(user_id)
             response_style = self.analyze_response_style_preference(user_id)
@@ -279,10 +643,9 @@ class UserBehaviorTracker:
                 adjustments.append("The user seems confused or off-track. Be extra clear, ask clarifying questions if needed, and ensure you're addressing their actual question.")
             
             # Low satisfaction handling
-            if profile.satisfaction_history:
-                avg_satisfaction = sum(profile.satisfaction_history[-5:]) / len(profile.satisfaction_history[-5:])
-                if avg_satisfaction < 4:
-                    adjustments.append("Previous interactions had low satisfaction. Be more helpful, accurate, and empathetic.")
+            avg_satisfaction = profile.recent_satisfaction_avg()
+            if avg_satisfaction is not None and avg_satisfaction < 4:
+                adjustments.append("Previous interactions had low satisfaction. Be more helpful, accurate, and empathetic.")
             
             if adjustments:
                 personalized_note = "\n\nPERSONALIZATION NOTES:\n" + "\n".join(f"- {adj}" for adj in adjustments)
@@ -298,22 +661,15 @@ class UserBehaviorTracker:
                 "user_id": user_id,
                 "satisfaction_score": satisfaction_score
             }
-        )
+        ) if _TRACE_ENABLED else _NULL_CTX
         
         with trace_context:
             profile = self.get_user_profile(user_id)
             
-            # Analyze feedback for improvement signals
-            feedback_lower = feedback.lower()
-            
-            # Extract improvement signals
-            improvement_signals = {
-                "too_long": "too long" in feedback_lower or "verbose" in feedback_lower,
-                "too_short": "too short" in feedback_lower or "brief" in feedback_lower,
-                "not_helpful": "not helpful" in feedback_lower or "useless" in feedback_lower,
-                "inaccurate": "wrong" in feedback_lower or "incorrect" in feedback_lower,
-                "tone_issue": "rude" in feedback_lower or "inappropriate" in feedback_lower
-            }
+            # Extract improvement signals in a single pass over the feedback
+            improvement_signals = dict.fromkeys(FEEDBACK_SIGNAL_RE.groupindex, False)
+            for match in FEEDBACK_SIGNAL_RE.finditer(feedback.lower()):
+                improvement_signals[match.lastgroup] = True
             
             # Update preferences based on feedback
             if improvement_signals["too_long"]:
@@ -324,61 +680,46 @@ class UserBehaviorTracker:
             if improvement_signals["tone_issue"]:
                 profile.preferences["tone"] = "more_professional"
             
-            # Store learning (gracefully handle missing tables)
+            # Queue learning for batched save to Supabase (flushed by background thread)
             if supabase:
-                # Check table existence on first use
-                if not self._supabase_tables_checked:
-                    self._check_supabase_tables()
-                
-                if self._has_user_learning_table:
-                    try:
-                        supabase.table('user_learning').insert({
-                            "user_id": user_id,
-                            "feedback": feedback,
-                            "satisfaction_score": satisfaction_score,
-                            "improvement_signals": improvement_signals,
-                            "timestamp": datetime.now().isoformat()
-                        }).execute()
-                    except Exception as e:
-                        print(f"⚠️ Failed to save learning to Supabase: {e}")
-                # If table doesn't exist, learning is still stored in user profile preferences
+                self._enqueue(self._pending_learning, {
+                    "user_id": user_id,
+                    "feedback": feedback,
+                    "satisfaction_score": satisfaction_score,
+                    "improvement_signals": improvement_signals,
+                    "timestamp": datetime.now()
+                })
             
             print(f"[BEHAVIOR] ✅ Learned from feedback for user {user_id}: {improvement_signals}")
     
     def get_reliability_metrics(self) -> Dict[str, Any]:
         """Get system reliability metrics"""
-        span_context = start_as_current_span(name="reliability_metrics")
+        span_context = start_as_current_span(name="reliability_metrics") if _TRACE_ENABLED else _NULL_CTX
         with span_context:
-            total_interactions = len(self.interactions)
+            total_interactions = self._total_interactions
             if total_interactions == 0:
                 return {"error": "No interactions recorded"}
             
-            # Calculate metrics
-            avg_satisfaction = sum(
-                i.satisfaction_score for i in self.interactions 
-                if i.satisfaction_score is not None
-            ) / len([i for i in self.interactions if i.satisfaction_score is not None]) if self.interactions else 0
+            # Calculate metrics from running aggregates
+            avg_satisfaction = self._sat_sum / self._sat_count if self._sat_count else 0
             
             off_track_rate = len(self.off_track_patterns) / len(self.user_profiles) if self.user_profiles else 0
             
             # Agent performance
-            agent_performance = defaultdict(lambda: {"count": 0, "avg_satisfaction": 0, "satisfaction_scores": []})
-            for interaction in self.interactions:
-                agent_perf = agent_performance[interaction.agent_name]
-                agent_perf["count"] += 1
-                if interaction.satisfaction_score is not None:
-                    agent_perf["satisfaction_scores"].append(interaction.satisfaction_score)
-            
-            for agent_name, perf in agent_performance.items():
-                if perf["satisfaction_scores"]:
-                    perf["avg_satisfaction"] = sum(perf["satisfaction_scores"]) / len(perf["satisfaction_scores"])
+            agent_performance = {
+                agent_name: {
+                    "count": count,
+                    "avg_satisfaction": sat_sum / sat_count if sat_count else 0
+                }
+                for agent_name, (count, sat_sum, sat_count) in self._agent_stats.items()
+            }
             
             return {
                 "total_interactions": total_interactions,
                 "unique_users": len(self.user_profiles),
                 "average_satisfaction": avg_satisfaction,
                 "off_track_rate": off_track_rate,
-                "agent_performance": dict(agent_performance),
+                "agent_performance": agent_performance,
                 "timestamp": datetime.now().isoformat()
             }
 